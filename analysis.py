@@ -0,0 +1,400 @@
+from codes import CPU, assemble
+import argparse
+import sys
+
+# stand in block for the end of the program (or a runtime error)
+EXIT = -1
+
+jumps = ["JMP", "JNZ", "JEZ", "JNE", "JPZ"]
+
+# static analysis of an assembled program, done before running it
+# builds the control flow graph over basic blocks, then finds
+# undefined labels, invalid instructions, unreachable code,
+# loops that can never exit, and an upper bound on steps
+class Analysis():
+    def __init__(self, program, labels):
+        self._program = program
+        self._labels = labels if labels is not None else {}
+
+        # (index, message) for every instruction step would always reject
+        self.invalid = []
+        # (index, label) for every jump to a label that does not exist
+        self.undefined_labels = []
+        for index, inst in enumerate(program):
+            if inst.operation in jumps and inst.args[0] not in self._labels:
+                self.undefined_labels.append((index, inst.args[0]))
+                continue
+            error = self._check(inst)
+            if error is not None:
+                self.invalid.append((index, error))
+
+        self._build_blocks()
+        self._build_edges()
+
+        reachable = self._reach([0] if self.blocks else [], self.successors)
+        exits = self._reach([EXIT], self._predecessors)
+
+        # (start, end) instruction ranges that execution can never get to
+        self.unreachable = [self.blocks[b] for b in range(len(self.blocks)) if b not in reachable]
+
+        # (start, end) instruction ranges of loops with no way out
+        self.no_exit = []
+        trapped = {b for b in reachable if b not in exits and b != EXIT}
+        for comp in self._sccs(trapped, self.successors):
+            if not self._is_loop(comp):
+                continue
+            if all(s in comp for b in comp for s in self.successors[b]):
+                self.no_exit.append((self.blocks[min(comp)][0], self.blocks[max(comp)][1]))
+        self.no_exit.sort()
+
+        # the first block can never get to the end, so it never stops
+        self.never_terminates = bool(self.blocks) and 0 in trapped
+
+        # most steps the program can take before ending, None if unknown
+        if not self.blocks:
+            self.step_bound = 0
+        elif self.never_terminates:
+            self.step_bound = None
+        else:
+            self.step_bound = self._longest(reachable - {EXIT}, 0, self.successors)
+
+    def __str__(self):
+        lines = [f"BLOCKS: {len(self.blocks)}"]
+        if self.undefined_labels:
+            lines.append("\nUNDEFINED LABELS")
+            for index, label in self.undefined_labels:
+                lines.append(f"Instruction {index}: {self._program[index]} jumps to undefined label {label}")
+        if self.invalid:
+            lines.append("\nINVALID INSTRUCTIONS")
+            for index, error in self.invalid:
+                lines.append(f"Instruction {index}: {self._program[index]}: {error}")
+        if self.unreachable:
+            lines.append("\nUNREACHABLE CODE")
+            for start, end in self.unreachable:
+                lines.append(self._range(start, end))
+        if self.no_exit:
+            lines.append("\nLOOPS WITHOUT AN EXIT")
+            for start, end in self.no_exit:
+                lines.append(self._range(start, end))
+
+        lines.append("")
+        if self.never_terminates:
+            lines.append("PROGRAM NEVER TERMINATES")
+        elif self.step_bound is None:
+            lines.append("STEP BOUND: unknown")
+        else:
+            lines.append(f"STEP BOUND: {self.step_bound}")
+        return "\n".join(lines)
+
+    # true if step would stop on an error or never stop
+    def has_errors(self):
+        return bool(self.undefined_labels or self.invalid or self.never_terminates)
+
+    def _range(self, start, end):
+        if end - start == 1:
+            return f"Instruction {start}: {self._program[start]}"
+        return f"Instructions {start} to {end - 1}: {self._program[start]} ... {self._program[end - 1]}"
+
+    # returns why step would always raise on this instruction, or None if it would not
+    # mirrors the operand checks in CPU.step and the register classes
+    def _check(self, inst):
+        r, s = CPU.regs1b, CPU.regs2b
+        args = inst.args
+
+        def imm(text, low, high):
+            try:
+                val = int(text, 0)
+            except ValueError:
+                return f"{text} is not a number"
+            if not low <= val <= high:
+                return f"Immediate {text} out of range ({low} to {high})"
+            return None
+
+        match inst.operation:
+            case "NOP" | "JMP" | "JNZ" | "JEZ" | "JNE" | "JPZ":
+                return None
+            case "MOV":
+                if not ((args[0] in r and args[1] in r) or (args[0] in s and args[1] in s)):
+                    return "Registers must both be A, B, C, D or both be X, Y"
+            case "LDI":
+                if args[0] in r:
+                    return imm(args[1], -128, 255)
+                if args[0] in s:
+                    return imm(args[1], 0, 65535)
+                return "Destination register not A, B, C, D, X, or Y"
+            case "RDM":
+                if not (args[0] in r and args[1] in s):
+                    return "Expected A, B, C, or D then X or Y"
+            case "WRM":
+                if not (args[0] in s and args[1] in r):
+                    return "Expected X or Y then A, B, C, or D"
+            case "CMP":
+                if not (args[0] in r and args[1] in r):
+                    return "Registers must be A, B, C, or D"
+            case "CMPI":
+                if args[0] not in r:
+                    return "Register must be A, B, C, or D"
+                return imm(args[1], -128, 255)
+            case "LSL" | "LSR":
+                if not (args[0] in r and args[1] in r):
+                    return "Registers must be A, B, C, or D"
+                return imm(args[2], 0, 7)
+            case "INC" | "DEC":
+                if args[0] not in s:
+                    return "Register must be X or Y"
+            case "INV":
+                if args[0] not in r:
+                    return "Register must be A, B, C, or D"
+            case "ADD" | "SUB" | "ORL" | "ANDL" | "XORL":
+                if not all(arg in r for arg in args):
+                    return "Registers must be A, B, C, or D"
+            case "ADDI" | "SUBI":
+                if not (args[0] in r and args[1] in r):
+                    return "Registers must be A, B, C, or D"
+                return imm(args[2], -128, 255)
+        return None
+
+    # returns the 1 byte register an instruction writes, or None
+    def _writes(self, inst):
+        if inst.operation in ["NOP", "WRM", "CMP", "CMPI", "INC", "DEC"] or inst.operation in jumps:
+            return None
+        if inst.args[0] in CPU.regs1b:
+            return inst.args[0]
+        return None
+
+    # splits the program into basic blocks of (start, end) instruction indices
+    def _build_blocks(self):
+        n = len(self._program)
+        leaders = {0} if n else set()
+        for index in self._labels.values():
+            if 0 <= index < n:
+                leaders.add(index)
+        for index, inst in enumerate(self._program):
+            if inst.operation in jumps and index + 1 < n:
+                leaders.add(index + 1)
+
+        starts = sorted(leaders)
+        self.blocks = [(start, end) for start, end in zip(starts, starts[1:] + [n])]
+        self._block_of = {}
+        for b, (start, end) in enumerate(self.blocks):
+            for index in range(start, end):
+                self._block_of[index] = b
+
+    def _block_at(self, index):
+        return self._block_of.get(index, EXIT)
+
+    def _build_edges(self):
+        bad = {index for index, _ in self.invalid} | {index for index, _ in self.undefined_labels}
+        self.successors = {EXIT: set()}
+        for b, (start, end) in enumerate(self.blocks):
+            last = self._program[end - 1]
+            if any(index in bad for index in range(start, end)):
+                # step raises here every time, which ends the program
+                succ = {EXIT}
+            elif last.operation == "JMP":
+                succ = {self._block_at(self._labels[last.args[0]])}
+            elif last.operation in jumps:
+                succ = {self._block_at(self._labels[last.args[0]]), self._block_at(end)}
+            else:
+                succ = {self._block_at(end)}
+            self.successors[b] = succ
+
+        self._predecessors = {b: set() for b in self.successors}
+        for b, succ in self.successors.items():
+            for s in succ:
+                self._predecessors[s].add(b)
+
+    def _reach(self, starts, edges):
+        seen = set(starts)
+        stack = list(starts)
+        while stack:
+            for nxt in edges[stack.pop()]:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        return seen
+
+    # strongly connected components of the graph limited to nodes
+    # returned in topological order (Tarjan finds them in reverse)
+    def _sccs(self, nodes, edges):
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        comps = []
+
+        def visit(v):
+            index[v] = low[v] = len(index)
+            stack.append(v)
+            on_stack.add(v)
+            for w in edges[v]:
+                if w not in nodes:
+                    continue
+                if w not in index:
+                    visit(w)
+                    low[v] = min(low[v], low[w])
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+            if low[v] == index[v]:
+                comp = set()
+                while True:
+                    w = stack.pop()
+                    on_stack.remove(w)
+                    comp.add(w)
+                    if w == v:
+                        break
+                comps.append(comp)
+
+        for v in sorted(nodes):
+            if v not in index:
+                visit(v)
+        comps.reverse()
+        return comps
+
+    def _is_loop(self, comp):
+        if len(comp) > 1:
+            return True
+        b = next(iter(comp))
+        return b in self.successors[b]
+
+    # most steps taken starting from block start, staying inside nodes
+    # every loop has to be a counted loop, otherwise returns None
+    def _longest(self, nodes, start, edges):
+        nodes = self._reach([start], {b: edges[b] & nodes for b in nodes})
+        comps = self._sccs(nodes, edges)
+        comp_of = {}
+        for i, comp in enumerate(comps):
+            for b in comp:
+                comp_of[b] = i
+
+        cost = []
+        for comp in comps:
+            if not (len(comp) > 1 or next(iter(comp)) in edges[next(iter(comp))]):
+                b = next(iter(comp))
+                cost.append(self.blocks[b][1] - self.blocks[b][0])
+                continue
+
+            # only loops with one way in and one way back can be counted
+            entries = {b for b in comp if b == start or any(b in edges[p] for p in nodes - comp)}
+            if len(entries) != 1:
+                return None
+            header = entries.pop()
+            latches = [b for b in comp if header in edges[b]]
+            if len(latches) != 1:
+                return None
+            latch = latches[0]
+
+            iterations = self._iterations(comp, header, latch)
+            if iterations is None:
+                return None
+
+            # cut the back edge and find the longest single pass through the body
+            inner = dict(edges)
+            inner[latch] = edges[latch] - {header}
+            body = self._longest(comp, header, inner)
+            if body is None:
+                return None
+            cost.append(iterations * body)
+
+        # comps are in topological order, so one pass finds the longest path
+        dist = [None] * len(comps)
+        dist[comp_of[start]] = cost[comp_of[start]]
+        for i, comp in enumerate(comps):
+            if dist[i] is None:
+                continue
+            for b in comp:
+                for s in edges[b]:
+                    if s in comp_of and comp_of[s] != i:
+                        j = comp_of[s]
+                        if dist[j] is None or dist[i] + cost[j] > dist[j]:
+                            dist[j] = dist[i] + cost[j]
+        return max(d for d in dist if d is not None)
+
+    # most times a loop can go around, None if its counter is not recognized
+    # the latch block has to end with one of
+    #   ADDI/SUBI R, R, k then JNZ header
+    #   ADDI/SUBI R, R, k then CMPI R, n then JNZ header
+    # and R can not be written anywhere else in the loop
+    def _iterations(self, comp, header, latch):
+        start, end = self.blocks[latch]
+        insts = self._program[start:end]
+        if insts[-1].operation != "JNZ" or self._block_at(self._labels[insts[-1].args[0]]) != header:
+            return None
+
+        target = 0
+        update = end - 2
+        if len(insts) >= 3 and insts[-2].operation == "CMPI":
+            target = int(insts[-2].args[1], 0)
+            # cmp does not wrap the immediate, so a negative one is never equal
+            # and the loop has no counted exit, for example
+            #   LDI A, 3 / L: / SUBI A, A, 1 / CMPI A, -1 / JNZ L
+            # never stops even though A passes through 0xFF
+            if target < 0:
+                return None
+            update = end - 3
+            if update < start or insts[-2].args[0] != self._program[update].args[0]:
+                return None
+        if update < start:
+            return None
+
+        inst = self._program[update]
+        if inst.operation not in ["ADDI", "SUBI"] or inst.args[0] != inst.args[1]:
+            return None
+        counter = inst.args[0]
+        delta = int(inst.args[2], 0)
+        if inst.operation == "SUBI":
+            delta = -delta
+        delta %= 256
+
+        for b in comp:
+            for index in range(*self.blocks[b]):
+                if index != update and self._writes(self._program[index]) == counter:
+                    return None
+
+        # counter value on the way in, known only if every entry agrees
+        values = set()
+        for p in self._predecessors[header]:
+            if p not in comp:
+                values.add(self._entry_value(p, counter))
+        if header == 0:
+            # registers start at 0
+            values.add(0)
+
+        if len(values) == 1 and None not in values:
+            value = values.pop()
+            for i in range(1, 257):
+                if (value + i * delta) % 256 == target:
+                    return i
+            return None
+
+        # an odd step visits every value, so any start reaches the target within 256
+        if delta % 2 == 1:
+            return 256
+        return None
+
+    # value a 1 byte register has at the end of block b if it is loaded there
+    def _entry_value(self, b, reg):
+        if b == EXIT:
+            return None
+        start, end = self.blocks[b]
+        for index in range(end - 1, start - 1, -1):
+            inst = self._program[index]
+            if self._writes(inst) == reg:
+                if inst.operation == "LDI":
+                    return int(inst.args[1], 0) % 256
+                return None
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Static control flow analysis of a .lab7 program")
+    parser.add_argument("-f", default="program.lab7", help="file to analyze, defaults to program.lab7")
+    args = parser.parse_args()
+
+    program, _, labels = assemble(args.f)
+    analysis = Analysis(program, labels)
+    print(analysis)
+    if analysis.has_errors():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -549,14 +549,26 @@ class CPU():
         if inc_pc:
             self._index += 1
 
+    # snapshot of everything step can change, used to compare two runs
+    # registers are read directly so X and Y are not wrapped to 1024
+    def state(self):
+        regs = {key: value._value for key, value in self._regmap.items()}
+        return {"regs": regs, "zero": self._zerof, "negative": self._negativef,
+                "pc": self._index, "memory": list(self._memory)}
+
 # takes in file name, returns program and memory
 def assemble(file_name):
+    with open(file_name) as f:
+        return assemble_lines(f)
+
+# takes in an iterable of source lines, returns program and memory
+def assemble_lines(lines):
     index = 0
     line_num = 0
     labels = {}
     memory = [0] * 1024
     program = []
-    for line in open(file_name):
+    for line in lines:
         line_num += 1
         # get rid of newline before anything
         line = line.strip() 
@@ -0,0 +1,271 @@
+from codes import CPU, assemble_lines
+import argparse
+import importlib
+import random
+import sys
+import time
+
+# generates random valid .lab7 programs
+# every backwards jump is a counted loop, so every program terminates
+class ProgramGenerator():
+    def __init__(self, rng, max_depth=3, max_block=6, max_iters=8):
+        self._rng = rng
+        # how deep loops and skipped blocks can nest
+        self._max_depth = max_depth
+        # most items (instructions, loops, skips) in a single block
+        self._max_block = max_block
+        # most iterations of a single loop
+        self._max_iters = max_iters
+        self._label_count = 0
+
+    def _label(self):
+        name = f"L{self._label_count}"
+        self._label_count += 1
+        return name
+
+    # 1 byte immediate in decimal, hex or binary
+    def _imm1(self):
+        val = self._rng.randint(-128, 255)
+        if val < 0:
+            return str(val)
+        return self._rng.choice([str(val), hex(val), bin(val)])
+
+    # 2 byte immediate, biased towards the wraparound edges
+    def _imm2(self):
+        val = self._rng.choice([
+            self._rng.randint(0, 1023),
+            self._rng.randint(0, 65535),
+            self._rng.choice([0, 1, 1023, 1024, 65534, 65535]),
+        ])
+        return self._rng.choice([str(val), hex(val)])
+
+    # single random instruction that never writes a protected register
+    def _instruction(self, protected):
+        rng = self._rng
+        regs = CPU.regs1b
+        # loop counters can be read but not written
+        dest = rng.choice([r for r in regs if r not in protected])
+        r1 = rng.choice(regs)
+        r2 = rng.choice(regs)
+        s1 = rng.choice(CPU.regs2b)
+        s2 = rng.choice(CPU.regs2b)
+
+        # memory traffic is weighted up so X and Y get exercised
+        choices = [
+            (1, "NOP"),
+            (2, f"MOV {dest}, {r1}"),
+            (1, f"MOV {s1}, {s2}"),
+            (3, f"LDI {dest}, {self._imm1()}"),
+            (3, f"LDI {s1}, {self._imm2()}"),
+            (4, f"RDM {dest}, {s1}"),
+            (4, f"WRM {s1}, {r1}"),
+            (3, f"INC {s1}"),
+            (3, f"DEC {s1}"),
+            (2, f"CMP {r1}, {r2}"),
+            (2, f"CMPI {r1}, {self._imm1()}"),
+            (1, f"LSL {dest}, {r1}, {rng.randint(0, 7)}"),
+            (1, f"LSR {dest}, {r1}, {rng.randint(0, 7)}"),
+            (1, f"INV {dest}"),
+            (2, f"ADD {dest}, {r1}, {r2}"),
+            (2, f"ADDI {dest}, {r1}, {self._imm1()}"),
+            (2, f"SUB {dest}, {r1}, {r2}"),
+            (2, f"SUBI {dest}, {r1}, {self._imm1()}"),
+            (1, f"ORL {dest}, {r1}, {r2}"),
+            (1, f"ANDL {dest}, {r1}, {r2}"),
+            (1, f"XORL {dest}, {r1}, {r2}"),
+        ]
+        weights = [w for w, _ in choices]
+        return rng.choices([inst for _, inst in choices], weights)[0]
+
+    def _block(self, depth, protected, size=None):
+        lines = []
+        if size is None:
+            size = self._rng.randint(1, self._max_block)
+        for _ in range(size):
+            roll = self._rng.random()
+            if roll < 0.15 and depth < self._max_depth:
+                lines += self._loop(depth, protected)
+            elif roll < 0.25 and depth < self._max_depth:
+                lines += self._skip(depth, protected)
+            else:
+                lines.append(self._instruction(protected))
+        return lines
+
+    # counted loop, the counter is protected inside the body
+    # a walking loop also reads or writes memory and moves X or Y every pass
+    def _loop(self, depth, protected, walk=False):
+        counter = self._rng.choice([r for r in CPU.regs1b if r not in protected])
+        label = self._label()
+        body = self._block(depth + 1, protected | {counter})
+        if walk:
+            s1 = self._rng.choice(CPU.regs2b)
+            dest = self._rng.choice([r for r in CPU.regs1b if r not in protected and r != counter])
+            r1 = self._rng.choice(CPU.regs1b)
+            mem = self._rng.choice([f"RDM {dest}, {s1}", f"WRM {s1}, {r1}"])
+            body += [mem, f"{self._rng.choice(['INC', 'DEC'])} {s1}"]
+        return ([f"LDI {counter}, {self._rng.randint(1, self._max_iters)}", f"{label}:"]
+                + body
+                + [f"SUBI {counter}, {counter}, 1", f"JNZ {label}"])
+
+    # forward jump over a block, always lands in the same scope
+    def _skip(self, depth, protected):
+        label = self._label()
+        op = self._rng.choice(["JMP", "JNZ", "JEZ", "JNE", "JPZ"])
+        return [f"{op} {label}"] + self._block(depth + 1, protected) + [f"{label}:"]
+
+    # returns a program as a list of source lines
+    def generate(self):
+        self._label_count = 0
+        lines = []
+        for _ in range(self._rng.randint(0, 3)):
+            if self._rng.random() < 0.5:
+                lines.append(f".byte {hex(self._rng.randint(0, 1023))} {self._imm1()}")
+            else:
+                length = self._rng.randint(1, 10)
+                data = " ".join(self._imm1() for _ in range(length))
+                lines.append(f".list {length} {hex(self._rng.randint(0, 1024 - length))} {data}")
+        # always have one walking loop so wraparound and flags get exercised
+        size = self._rng.randint(4, 3 * self._max_block)
+        pos = self._rng.randint(0, size)
+        lines += self._block(0, frozenset(), pos)
+        lines += self._loop(0, frozenset(), walk=True)
+        lines += self._block(0, frozenset(), size - pos)
+        return lines
+
+# loads an engine from "module:Class"
+# an engine is built like CPU(program, memory, labels) and has step() and state()
+def load_engine(spec):
+    module, _, name = spec.partition(":")
+    if not name:
+        raise ValueError(f"Engine must be given as module:Class, received {spec} instead")
+    return getattr(importlib.import_module(module), name)
+
+# runs a program to completion (or max_steps) on one engine
+# returns the outcome, the number of steps, and the time taken
+def run(engine, lines, max_steps):
+    # assemble fresh so engines never share memory or instructions
+    cpu = engine(*assemble_lines(lines))
+    # only time the steps, not assembling or building the engine
+    start = time.perf_counter()
+    steps = 0
+    error = None
+    while steps < max_steps:
+        try:
+            cpu.step()
+        except EOFError:
+            break
+        except Exception as e:
+            error = type(e).__name__
+            break
+        steps += 1
+    elapsed = time.perf_counter() - start
+    return {"steps": steps, "error": error, **cpu.state()}, steps, elapsed
+
+# lists the fields of two outcomes that do not match
+def differences(expected, actual):
+    diffs = []
+    for key in expected:
+        if key not in actual:
+            diffs.append(f"{key}: missing from state")
+        elif key == "memory":
+            if len(expected["memory"]) != len(actual["memory"]):
+                diffs.append(f"memory length: {len(expected['memory'])} != {len(actual['memory'])}")
+            for addr, (a, b) in enumerate(zip(expected["memory"], actual["memory"])):
+                if a != b:
+                    diffs.append(f"memory[{hex(addr)}]: {a} != {b}")
+        elif key == "regs":
+            for reg, val in expected["regs"].items():
+                if actual["regs"].get(reg) != val:
+                    diffs.append(f"Register {reg}: {val} != {actual['regs'].get(reg)}")
+        elif expected[key] != actual.get(key):
+            diffs.append(f"{key}: {expected[key]} != {actual.get(key)}")
+    return diffs
+
+# runs a program on every engine, returns {name: (outcome, steps, time)}
+def run_all(engines, lines, max_steps):
+    return {name: run(engine, lines, max_steps) for name, engine in engines.items()}
+
+# returns (engine name, differences) for the first engine that disagrees with the reference
+# the reference is the first engine in results
+def diverges(results):
+    names = list(results)
+    expected = results[names[0]][0]
+    for name in names[1:]:
+        diffs = differences(expected, results[name][0])
+        if diffs:
+            return name, diffs
+    return None
+
+# greedy delta debugging: drop chunks of lines while the engines still disagree
+def shrink(lines, still_fails):
+    chunk = len(lines) // 2
+    while chunk >= 1:
+        i = 0
+        while i < len(lines):
+            candidate = lines[:i] + lines[i + chunk:]
+            if candidate and still_fails(candidate):
+                lines = candidate
+            else:
+                i += chunk
+        chunk //= 2
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Differential fuzzer for CPU.step and alternate engines")
+    parser.add_argument("-n", type=int, default=200, help="number of programs to generate")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the first program, random if not given")
+    parser.add_argument("--steps", type=int, default=100000, help="most steps to run each program for")
+    parser.add_argument("-e", action="append", default=[], metavar="module:Class",
+                        help="alternate engine to compare against CPU.step, can be repeated")
+    parser.add_argument("-o", default="fuzz_fail.lab7", help="file to write a shrunk failing program to")
+    args = parser.parse_args()
+
+    engines = {"step": CPU}
+    for spec in args.e:
+        engines[spec] = load_engine(spec)
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print(f"Seed: {seed}")
+    totals = {name: [0, 0.0] for name in engines}
+
+    for i in range(args.n):
+        # each program has its own seed so a failure can be regenerated alone
+        lines = ProgramGenerator(random.Random(seed + i)).generate()
+        results = run_all(engines, lines, args.steps)
+        for name, (outcome, steps, elapsed) in results.items():
+            totals[name][0] += steps
+            totals[name][1] += elapsed
+
+        if diverges(results) is None:
+            continue
+        print(f"Program {i} (seed {seed + i}): engines disagree with step")
+        smallest = shrink(lines, lambda cand: _fails(engines, cand, args.steps))
+        # shrinking only keeps failing programs, so this always disagrees
+        name, diffs = diverges(run_all(engines, smallest, args.steps))
+        with open(args.o, "w") as f:
+            f.write("\n".join(smallest) + "\n")
+        print(f"Shrunk from {len(lines)} to {len(smallest)} lines, written to {args.o}:")
+        print("\n".join(smallest))
+        print(f"\n{name} disagrees with step:")
+        print("\n".join(diffs))
+        _report(totals)
+        sys.exit(1)
+
+    print(f"{args.n} programs, all engines agree")
+    _report(totals)
+
+# true if the candidate assembles and some engine disagrees with the reference
+def _fails(engines, lines, max_steps):
+    try:
+        assemble_lines(lines)
+    except Exception:
+        return False
+    return diverges(run_all(engines, lines, max_steps)) is not None
+
+def _report(totals):
+    for name, (steps, elapsed) in totals.items():
+        rate = steps / elapsed if elapsed > 0 else 0
+        print(f"{name}: {steps} instructions in {elapsed:.3f}s, {rate:,.0f} instructions/sec")
+
+if __name__ == "__main__":
+    main()